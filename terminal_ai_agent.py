@@ -11,41 +11,137 @@ import sys
 import argparse
 import time
 import logging
+import asyncio
+import concurrent.futures
+import functools
+import bisect
+import copy
 from dotenv import load_dotenv
 import pty
 import subprocess
 import threading
+import queue
 import select
+import selectors
 import termios
 import fcntl
 import struct
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, asdict
+import signal
+import codecs
+import unicodedata
+import hashlib
+import sqlite3
+import shlex
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import dataclasses
+from dataclasses import dataclass
 from enum import Enum
-import requests
+
+try:
+    # Optional linear-time engine for the safety checker; falls back to re
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    # Optional faster JSON codec; falls back to the stdlib json module
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _json_loads(data):
+    """Parse JSON text or bytes, using orjson when installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps(obj) -> str:
+    """Serialize to JSON text, using orjson when installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, default=str)
+
+def _write_json(obj):
+    """Write indented JSON to stdout without building an intermediate str"""
+    if orjson is not None:
+        # Flush pending text output first so ordering is preserved
+        sys.stdout.flush()
+        sys.stdout.buffer.write(orjson.dumps(obj, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+        sys.stdout.buffer.flush()
+    else:
+        json.dump(obj, sys.stdout, indent=2, default=str)
+        sys.stdout.write("\n")
+
+def _canonical_goal(goal: str) -> str:
+    """Normalize a goal for cache keys
+    
+    Only differences that can't change the plan are removed: Unicode
+    composition (NFC) and surrounding whitespace. Case, inner spacing and
+    compatibility characters are kept, since goals such as "create Foo.txt"
+    and "write 'a  b' to x.txt" need exactly what they say.
+    """
+    return unicodedata.normalize("NFC", goal).strip()
+
 # ======================
 # Configuration
 # ======================
 
+# .env is parsed once at import; the agent and the CLI share these defaults
+load_dotenv()
+_DEFAULT_API_KEY = os.getenv("OPENAI_API_KEY")
+_DEFAULT_BASE_URL = os.getenv("OPENAI_BASE_URL")
+_DEFAULT_MODEL = os.getenv("AI_MODEL")
+
 class CommandRisk(Enum):
     SAFE = "safe"
     CAUTION = "caution"
     DANGEROUS = "dangerous"
     CRITICAL = "critical"
 
+# Plain dict lookup is much cheaper than the Enum constructor on hot paths
+_RISK_BY_VALUE = {risk.value: risk for risk in CommandRisk}
+
+# Severity order of the risk levels, lowest first
+_RISK_RANK = {risk: rank for rank, risk in enumerate(CommandRisk)}
+
+# Icon shown next to each risk level in the to-do list
+_RISK_ICONS = {
+    "safe": "✅",
+    "caution": "⚠️",
+    "dangerous": "🚨",
+    "critical": "💀"
+}
+
+# To-do risk levels that need the user's confirmation before running
+_CONFIRM_RISK_LEVELS = frozenset({"dangerous", "critical"})
+
+# Icon shown next to each to-do status in the execution results
+_STATUS_ICONS = {
+    "completed": "✅",
+    "failed": "❌"
+}
+
 # ======================
 # Safety Checker
 # ======================
 
+def _compile_safety_pattern(pattern: str):
+    """Compile a case-insensitive safety pattern, preferring RE2 when installed"""
+    if re2 is not None:
+        return re2.compile(f"(?i){pattern}")
+    return re.compile(pattern, re.IGNORECASE)
+
 class AISafetyChecker:
     """Checks commands for safety and provides risk assessment"""
     
-    DANGEROUS_PATTERNS = [
+    # Patterns are compiled once at class load and matched case-insensitively,
+    # which replaces the per-call command.lower()
+    _DANGEROUS_SOURCES = [
         (r'\brm\s+-rf\b', 'Recursive force delete'),
         (r'\brm\s+-rf\s*/', 'Delete root directory'),
         (r'\bchmod\s+777\b', 'World-writable permissions'),
@@ -61,7 +157,7 @@ class AISafetyChecker:
         (r'\bchmod\s+[0-7]777\b', 'Overly permissive'),
     ]
     
-    CAUTION_PATTERNS = [
+    _CAUTION_SOURCES = [
         (r'\brm\b', 'File deletion'),
         (r'\bchmod\b', 'Permission changes'),
         (r'\bchown\b', 'Ownership changes'),
@@ -74,40 +170,93 @@ class AISafetyChecker:
         (r'\bpip\b', 'Python package management'),
     ]
     
+    DANGEROUS_PATTERNS = [(_compile_safety_pattern(p), warning) for p, warning in _DANGEROUS_SOURCES]
+    CAUTION_PATTERNS = [(_compile_safety_pattern(p), warning) for p, warning in _CAUTION_SOURCES]
+    
+    # One alternation per risk tier so assess_risk does a single scan per
+    # tier instead of one search per pattern
+    _DANGEROUS_RE = _compile_safety_pattern('|'.join(f'(?:{p})' for p, _ in _DANGEROUS_SOURCES))
+    _CAUTION_RE = _compile_safety_pattern('|'.join(f'(?:{p})' for p, _ in _CAUTION_SOURCES))
+    
     @classmethod
     def assess_risk(cls, command: str) -> CommandRisk:
         """Assess the risk level of a command"""
-        command_lower = command.lower()
-        
         # Check for dangerous patterns
-        for pattern, _ in cls.DANGEROUS_PATTERNS:
-            if re.search(pattern, command_lower):
-                return CommandRisk.CRITICAL
-                
+        if cls._DANGEROUS_RE.search(command):
+            return CommandRisk.CRITICAL
+        
         # Check for caution patterns
-        for pattern, _ in cls.CAUTION_PATTERNS:
-            if re.search(pattern, command_lower):
-                return CommandRisk.CAUTION
-                
+        if cls._CAUTION_RE.search(command):
+            return CommandRisk.CAUTION
+        
         return CommandRisk.SAFE
     
+    @classmethod
+    def assess_risk_batch(cls, commands: List[str]) -> List[CommandRisk]:
+        """Assess several commands with one scan per tier over the joined text
+        
+        Gives the same result as calling assess_risk on each command.
+        """
+        text = "\n".join(commands)
+        # starts[i] is where command i begins in the joined text
+        starts = [0]
+        for command in commands:
+            starts.append(starts[-1] + len(command) + 1)
+        
+        risks = [CommandRisk.SAFE] * len(commands)
+        for tier_re, risk in ((cls._CAUTION_RE, CommandRisk.CAUTION), (cls._DANGEROUS_RE, CommandRisk.CRITICAL)):
+            pos = 0
+            while pos < len(text):
+                match = tier_re.search(text, pos)
+                if match is None:
+                    break
+                index = bisect.bisect_right(starts, match.start()) - 1
+                # Patterns such as \s+ can run on into the next command; such
+                # a match doesn't count and the command is checked on its own
+                if match.end() < starts[index + 1] or tier_re.search(commands[index]):
+                    risks[index] = risk
+                pos = starts[index + 1]
+        return risks
+    
     @classmethod
     def get_warnings(cls, command: str) -> List[str]:
         """Get specific warnings for a command"""
+        return cls.classify(command)[1]
+    
+    @classmethod
+    def classify(cls, command: str) -> Tuple[CommandRisk, List[str]]:
+        """Assess risk and collect warnings for a command in a single scan"""
+        risk, warnings = cls._classify(command)
+        return risk, list(warnings)
+    
+    @classmethod
+    @functools.lru_cache(maxsize=256)
+    def _classify(cls, command: str) -> Tuple[CommandRisk, Tuple[str, ...]]:
+        """Cached worker for classify; plans often repeat commands like ls or pwd"""
+        risk = CommandRisk.SAFE
         warnings = []
-        command_lower = command.lower()
         
-        for pattern, warning in cls.DANGEROUS_PATTERNS + cls.CAUTION_PATTERNS:
-            if re.search(pattern, command_lower):
+        for pattern, warning in cls.DANGEROUS_PATTERNS:
+            if pattern.search(command):
+                risk = CommandRisk.CRITICAL
                 warnings.append(f"Potential risk: {warning}")
-                
-        return warnings
+        
+        for pattern, warning in cls.CAUTION_PATTERNS:
+            if pattern.search(command):
+                if risk is CommandRisk.SAFE:
+                    risk = CommandRisk.CAUTION
+                warnings.append(f"Potential risk: {warning}")
+        
+        return risk, tuple(warnings)
 
 # ======================
 # Data Classes
 # ======================
 
-@dataclass
+# __slots__ dataclasses need Python 3.10+; older interpreters keep __dict__
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(**_DATACLASS_SLOTS)
 class CommandStep:
     command: str
     reasoning: str
@@ -119,15 +268,58 @@ class CommandStep:
         if self.alternatives is None:
             self.alternatives = []
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class PlanningResult:
     steps: List[CommandStep]
     overall_risk: CommandRisk
     requires_confirmation: bool
     estimated_time: str
     success_criteria: List[str]
+    is_fallback: bool = False  # built locally because the API was unavailable
+    # Token usage of the API call that produced the plan (0 when none was made)
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert plan to dictionary for JSON serialization"""
+        return {
+            "steps": [
+                {
+                    "command": step.command,
+                    "reasoning": step.reasoning,
+                    "risk_level": step.risk_level.value,
+                    "expected_output": step.expected_output,
+                    "alternatives": step.alternatives
+                }
+                for step in self.steps
+            ],
+            "overall_risk": self.overall_risk.value,
+            "requires_confirmation": self.requires_confirmation,
+            "estimated_time": self.estimated_time,
+            "success_criteria": self.success_criteria
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PlanningResult":
+        """Rebuild a plan from the output of to_dict"""
+        return cls(
+            steps=[
+                CommandStep(
+                    command=step["command"],
+                    reasoning=step["reasoning"],
+                    risk_level=_RISK_BY_VALUE[step["risk_level"]],
+                    expected_output=step["expected_output"],
+                    alternatives=step.get("alternatives", [])
+                )
+                for step in data["steps"]
+            ],
+            overall_risk=_RISK_BY_VALUE[data["overall_risk"]],
+            requires_confirmation=data["requires_confirmation"],
+            estimated_time=data.get("estimated_time", "unknown"),
+            success_criteria=data.get("success_criteria", [])
+        )
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class TodoItem:
     """Represents a single item in the to-do list"""
     id: int
@@ -136,25 +328,189 @@ class TodoItem:
     risk_level: str
     status: str = "pending"  # pending, running, completed, failed
     output: str = ""
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert item to dictionary for JSON serialization"""
+        return {
+            "id": self.id,
+            "command": self.command,
+            "reasoning": self.reasoning,
+            "risk_level": self.risk_level,
+            "status": self.status,
+            "output": self.output
+        }
+
+# Shown when no plan could be generated; copied with dataclasses.replace
+_FALLBACK_TODO = TodoItem(
+    id=1,
+    command="echo 'Failed to generate plan. Please try again.'",
+    reasoning="Fallback due to error",
+    risk_level="safe",
+    status="pending"
+)
 
 # ======================
 # PTY Session Manager
 # ======================
 
+class PTYReactor:
+    """Services the master fds of all PTY sessions from a single selector thread"""
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, busy_wait: bool = False):
+        self._selector = selectors.DefaultSelector()
+        # Poll without blocking, trading a fully busy CPU core for skipping
+        # the thread wakeup on each event. Only worth it for latency-critical
+        # interactive use.
+        self._busy_wait = busy_wait
+        # Held while reading or closing a registered fd, so the reactor can
+        # never read from an fd number that was closed and reused
+        self._lock = threading.Lock()
+        self._thread = None
+        # Reused for every read; sessions copy out of it
+        self._read_view = memoryview(bytearray(65536))
+        
+        # Self-pipe so register/unregister can interrupt a blocked select()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+    
+    @classmethod
+    def default(cls) -> "PTYReactor":
+        """Shared reactor for sessions created without one"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+    
+    def register(self, session: "PTYSession"):
+        """Start delivering output for a session"""
+        with self._lock:
+            self._selector.register(session.master_fd, selectors.EVENT_READ, session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wake()
+    
+    def close(self, session: "PTYSession"):
+        """Stop watching a session and close its master fd"""
+        with self._lock:
+            fd = session.master_fd
+            if fd is None:
+                return
+            self._unregister(fd)
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+            session.master_fd = None
+        self._wake()
+    
+    def _unregister(self, fd: int):
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+    
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            # Pipe already full, so a wakeup is pending anyway
+            pass
+    
+    def _run(self):
+        """Wait for readable fds and dispatch their output to the owning sessions"""
+        timeout = 0 if self._busy_wait else None
+        while True:
+            events = self._selector.select(timeout)
+            if not events and self._busy_wait:
+                os.sched_yield()
+                continue
+            
+            for key, _ in events:
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                
+                session = key.data
+                with self._lock:
+                    # Skip events for fds closed since select() returned
+                    if session.master_fd != key.fd:
+                        continue
+                    # Drain everything the shell has written so a burst is
+                    # handed over in one piece
+                    n = 0
+                    eof = False
+                    while n < len(self._read_view):
+                        try:
+                            got = os.readv(key.fd, (self._read_view[n:],))
+                        except BlockingIOError:
+                            break
+                        except OSError:
+                            # EIO once the shell has exited
+                            got = 0
+                        if not got:
+                            eof = True
+                            break
+                        n += got
+                    if eof:
+                        self._unregister(key.fd)
+                
+                # This thread serves every session, so one failing session
+                # must not stop the others from getting output
+                try:
+                    if n:
+                        session._on_output(self._read_view[:n])
+                    if eof:
+                        session._on_exit()
+                except Exception as e:
+                    logger.error(f"PTY session {session.session_id} output handling failed: {e}")
+
+# Environment overrides for session shells
+_SESSION_ENV = {"PAGER": "cat", "GIT_PAGER": "cat", "TERM": "dumb"}
+
 class PTYSession:
     """Manages a single persistent PTY session"""
     
-    def __init__(self, session_id: str, shell: str = "/bin/bash"):
+    __slots__ = (
+        "session_id", "shell", "shell_args", "reactor", "master_fd", "slave_fd", "process",
+        "is_running", "output_callbacks", "exit_callbacks", "output_buffer",
+        "_decoder", "_pending", "_cond", "_read_lock", "_pump_thread"
+    )
+    
+    def __init__(self, session_id: str, shell: str = "/bin/bash", reactor: PTYReactor = None,
+                 shell_args: Tuple[str, ...] = ()):
         self.session_id = session_id
         self.shell = shell
+        self.shell_args = tuple(shell_args)
+        self.reactor = reactor or PTYReactor.default()
         self.master_fd = None
         self.slave_fd = None
         self.process = None
         self.is_running = False
         self.output_callbacks = []
         self.exit_callbacks = []
-        self._output_thread = None
-        self.output_buffer = ""
+        # Raw scrollback of everything drained by read_output()
+        self.output_buffer = bytearray()
+        # Incremental decoder keeps multi-byte characters split across reads intact
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        # Raw output from the reactor, drained by read_output(). A single
+        # bytearray coalesces a burst of reads into one decode and one
+        # callback per drain instead of a str per chunk.
+        self._pending = bytearray()
+        self._cond = threading.Condition()
+        # The executor and the callback pump thread may both read; this keeps
+        # the scrollback, the decoder state and callback order consistent
+        self._read_lock = threading.Lock()
+        self._pump_thread = None
         
     def start(self) -> bool:
         """Start the PTY session"""
@@ -162,13 +518,15 @@ class PTYSession:
             # Create PTY
             self.master_fd, self.slave_fd = pty.openpty()
             
-            # Start shell process
+            # Start shell process. Commands run on a real terminal, so keep
+            # pagers and full-screen output from waiting for a keypress.
             self.process = subprocess.Popen(
-                [self.shell],
+                [self.shell, *self.shell_args],
                 stdin=self.slave_fd,
                 stdout=self.slave_fd,
                 stderr=self.slave_fd,
-                preexec_fn=os.setsid
+                preexec_fn=os.setsid,
+                env={**os.environ, **_SESSION_ENV}
             )
             
             # Close slave fd in parent
@@ -177,12 +535,10 @@ class PTYSession:
             
             self.is_running = True
             
-            # Start output reading thread
-            self._output_thread = threading.Thread(
-                target=self._read_output,
-                daemon=True
-            )
-            self._output_thread.start()
+            # Output is read by the shared reactor thread, which drains the
+            # fd until it would block
+            os.set_blocking(self.master_fd, False)
+            self.reactor.register(self)
             
             logger.info(f"PTY session {self.session_id} started")
             return True
@@ -192,40 +548,84 @@ class PTYSession:
             self.cleanup()
             return False
     
-    def _read_output(self):
-        """Read output from PTY and notify callbacks"""
-        while self.is_running and self.master_fd is not None:
+    def _on_output(self, data: memoryview):
+        """Queue raw output read by the reactor and wake consumers"""
+        with self._cond:
+            self._pending += data
+            self._cond.notify_all()
+    
+    def _on_exit(self):
+        """Called by the reactor once the PTY reaches EOF"""
+        self.is_running = False
+        with self._cond:
+            self._cond.notify_all()
+        for callback in self.exit_callbacks:
             try:
-                # Check if data is available
-                if self.master_fd is not None:
-                    ready, _, _ = select.select([self.master_fd], [], [], 0.1)
-                    
-                    if ready:
-                        if self.master_fd is not None:
-                            data = os.read(self.master_fd, 1024)
-                            if data:
-                                decoded_data = data.decode('utf-8', errors='replace')
-                                self.output_buffer += decoded_data
-                                for callback in self.output_callbacks:
-                                    callback(decoded_data)
-                            else:
-                                # EOF reached
-                                break
-                        
-            except OSError:
-                # PTY closed
-                break
+                callback()
             except Exception as e:
-                logger.error(f"Error reading output: {e}")
-                break
+                logger.error(f"Exit callback failed: {e}")
+    
+    def read_output(self, timeout: Optional[float] = None) -> str:
+        """Wait for output and return everything queued since the last call
         
-        self.is_running = False
-        for callback in self.exit_callbacks:
-            callback()
+        Returns an empty string on timeout or once the session has ended.
+        Output callbacks are called with the text before it is returned.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending or not self.is_running, timeout)
+        
+        # Another reader may have drained the output in the meantime, in
+        # which case this returns an empty string
+        with self._read_lock:
+            with self._cond:
+                data = bytes(self._pending)
+                self._pending.clear()
+            
+            if not data:
+                return ""
+            
+            self.output_buffer += data
+            decoded_data = self._decoder.decode(data)
+            if decoded_data:
+                for callback in self.output_callbacks:
+                    try:
+                        callback(decoded_data)
+                    except Exception as e:
+                        logger.error(f"Output callback failed: {e}")
+            return decoded_data
+    
+    @property
+    def output_text(self) -> str:
+        """Scrollback decoded as text"""
+        return self.output_buffer.decode('utf-8', errors='replace')
+    
+    async def stream(self):
+        """Yield output as it arrives until the session ends"""
+        loop = asyncio.get_running_loop()
+        while self.is_running or self._pending:
+            text = await loop.run_in_executor(None, self.read_output, 1.0)
+            if text:
+                yield text
+    
+    def _pump(self):
+        """Drain output for callback-only consumers"""
+        while self.is_running or self._pending:
+            self.read_output(1.0)
+    
+    def _write(self, fd: int, data: bytes):
+        """Write all of data to the non-blocking master fd"""
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(fd, view):]
+            except BlockingIOError:
+                # The shell is not reading; wait until there is room
+                select.select([], [fd], [])
     
     def execute_command(self, command: str) -> bool:
         """Execute a command in the PTY session"""
-        if not self.is_running or self.master_fd is None:
+        fd = self.master_fd
+        if not self.is_running or fd is None:
             return False
         
         try:
@@ -233,18 +633,43 @@ class PTYSession:
             if not command.endswith('\n'):
                 command += '\n'
             
-            if self.master_fd is not None:
-                os.write(self.master_fd, command.encode('utf-8'))
-                return True
-            return False
+            self._write(fd, command.encode('utf-8'))
+            return True
             
         except Exception as e:
             logger.error(f"Failed to execute command: {e}")
             return False
     
+    def execute_commands(self, commands: List[str]) -> bool:
+        """Execute several commands in the PTY session with a single write"""
+        fd = self.master_fd
+        if not self.is_running or fd is None:
+            return False
+        
+        try:
+            chunks = [
+                (command if command.endswith('\n') else command + '\n').encode('utf-8')
+                for command in commands
+            ]
+            try:
+                written = os.writev(fd, chunks)
+            except BlockingIOError:
+                written = 0
+            
+            # writev can stop early on a full PTY buffer; finish the rest
+            data = b"".join(chunks)
+            if written < len(data):
+                self._write(fd, data[written:])
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to execute commands: {e}")
+            return False
+    
     def send_control_character(self, char: str) -> bool:
         """Send control character (e.g., Ctrl+C)"""
-        if not self.is_running or self.master_fd is None:
+        fd = self.master_fd
+        if not self.is_running or fd is None:
             return False
         
         try:
@@ -258,10 +683,8 @@ class PTYSession:
             else:
                 return False
             
-            if self.master_fd is not None:
-                os.write(self.master_fd, control_char)
-                return True
-            return False
+            self._write(fd, control_char)
+            return True
             
         except Exception as e:
             logger.error(f"Failed to send control character: {e}")
@@ -269,16 +692,15 @@ class PTYSession:
     
     def resize(self, rows: int, cols: int) -> bool:
         """Resize the PTY terminal"""
-        if not self.is_running or self.master_fd is None:
+        fd = self.master_fd
+        if not self.is_running or fd is None:
             return False
         
         try:
             # Use TIOCSWINSZ to set window size
             winsize = struct.pack('HHHH', rows, cols, 0, 0)
-            if self.master_fd is not None:
-                fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, winsize)
-                return True
-            return False
+            fcntl.ioctl(fd, termios.TIOCSWINSZ, winsize)
+            return True
             
         except Exception as e:
             logger.error(f"Failed to resize PTY: {e}")
@@ -286,22 +708,67 @@ class PTYSession:
     
     def add_output_callback(self, callback):
         """Add callback for output data"""
-        self.output_callbacks.append(callback)
+        # Copy on write so dispatch can iterate without a lock; adding the
+        # same callback twice must not make it fire twice
+        if callback not in self.output_callbacks:
+            self.output_callbacks = self.output_callbacks + [callback]
+        
+        # Callbacks are driven by read_output; start a pump so they fire
+        # even when nothing else is reading
+        self._start_pump()
+    
+    def _start_pump(self):
+        """Start the callback pump thread if it isn't running"""
+        if self._pump_thread is None:
+            self._pump_thread = threading.Thread(target=self._pump, daemon=True)
+            self._pump_thread.start()
+    
+    def restart(self) -> bool:
+        """Replace the shell with a fresh one, keeping the session and its callbacks"""
+        pump = self._pump_thread
+        self.cleanup()
+        if pump is not None:
+            pump.join(timeout=2)
+            self._pump_thread = None
+        
+        with self._cond:
+            self._pending.clear()
+        self._decoder.reset()
+        
+        if not self.start():
+            return False
+        if self.output_callbacks:
+            self._start_pump()
+        return True
+    
+    def remove_output_callback(self, callback):
+        """Remove a previously added output callback"""
+        self.output_callbacks = [cb for cb in self.output_callbacks if cb != callback]
     
     def add_exit_callback(self, callback):
         """Add callback for session exit"""
-        self.exit_callbacks.append(callback)
+        if callback not in self.exit_callbacks:
+            self.exit_callbacks = self.exit_callbacks + [callback]
+    
+    def remove_exit_callback(self, callback):
+        """Remove a previously added exit callback"""
+        self.exit_callbacks = [cb for cb in self.exit_callbacks if cb != callback]
     
     def cleanup(self):
         """Clean up resources"""
         self.is_running = False
+        with self._cond:
+            self._cond.notify_all()
         
-        if self.master_fd is not None:
+        # Hang up the shell; interactive shells ignore the SIGTERM below
+        if self.process and self.process.poll() is None:
             try:
-                os.close(self.master_fd)
-            except:
+                self.process.send_signal(signal.SIGHUP)
+            except OSError:
                 pass
-            self.master_fd = None
+        
+        if self.master_fd is not None:
+            self.reactor.close(self)
         
         if self.slave_fd is not None:
             try:
@@ -323,17 +790,22 @@ class PTYSession:
 class PTYManager:
     """Manages multiple PTY sessions"""
     
-    def __init__(self):
+    __slots__ = ("sessions", "lock", "reactor")
+    
+    def __init__(self, busy_wait: bool = False):
         self.sessions = {}
         self.lock = threading.Lock()
+        # One reader thread for every session instead of one per session
+        self.reactor = PTYReactor(busy_wait)
     
-    def create_session(self, session_id: str, shell: str = "/bin/bash") -> bool:
+    def create_session(self, session_id: str, shell: str = "/bin/bash",
+                       shell_args: Tuple[str, ...] = ()) -> bool:
         """Create a new PTY session"""
         with self.lock:
             if session_id in self.sessions:
                 return False
             
-            session = PTYSession(session_id, shell)
+            session = PTYSession(session_id, shell, self.reactor, shell_args)
             if session.start():
                 self.sessions[session_id] = session
                 return True
@@ -341,8 +813,9 @@ class PTYManager:
     
     def get_session(self, session_id: str):
         """Get a PTY session by ID"""
-        with self.lock:
-            return self.sessions.get(session_id)
+        # A single dict lookup is atomic under the GIL; only mutations that
+        # check and then change the dict take the lock
+        return self.sessions.get(session_id)
     
     def execute_command(self, session_id: str, command: str) -> bool:
         """Execute command in specified session"""
@@ -387,37 +860,223 @@ class PTYManager:
 
 # Global manager instance
 manager = PTYManager()
+
 # ======================
-# AI Command Planner
+# Plan Memory
 # ======================
 
-class OpenAIPlanner:
-    """Uses OpenAI API to generate command plans"""
+class PlanMemory:
+    """Persists successfully executed plans in SQLite so recurring goals skip the LLM"""
     
-    def __init__(self, api_key: str, base_url: str = None, model: str = None):
-        self.api_key = api_key
-        self.base_url = base_url or "https://api.openai.com/v1"
-        self.model = model or "gpt-3.5-turbo"
+    # Bumped whenever _key changes so rows stored under old keys are dropped
+    _KEY_VERSION = 2
+    
+    def __init__(self, path: str, max_plans: int = 256, max_age: Optional[float] = None):
+        self.path = os.path.expanduser(path)
+        self.max_plans = max_plans
+        # Seconds since a plan last succeeded before it is no longer reused
+        self.max_age = max_age
+        self.lock = threading.Lock()
         
-    def generate_plan(self, user_request: str, context: Dict[str, Any] = None) -> PlanningResult:
-        """Generate a command plan from natural language"""
-        context = context or {}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
         
-        prompt = self._build_prompt(user_request, context)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            # Files from before plans were keyed by planner can't tell which
+            # model or prompt produced a plan, and files from an older
+            # _KEY_VERSION keyed goals that need different plans alike, so
+            # start over
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(plans)")}
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if columns and ("planner" not in columns or version < self._KEY_VERSION):
+                self._conn.execute("DROP TABLE plans")
+            self._conn.execute(f"PRAGMA user_version = {self._KEY_VERSION}")
+            
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS plans (
+                    goal TEXT NOT NULL,
+                    cwd TEXT NOT NULL,
+                    os TEXT NOT NULL,
+                    planner TEXT NOT NULL,
+                    plan_json TEXT NOT NULL,
+                    freq INTEGER NOT NULL DEFAULT 1,
+                    last_used REAL NOT NULL,
+                    remembered_at REAL NOT NULL,
+                    PRIMARY KEY (goal, cwd, os, planner)
+                )
+                """
+            )
+            self._conn.commit()
+        except sqlite3.Error:
+            # Not a usable database; don't leak the connection
+            self._conn.close()
+            raise
+    
+    @staticmethod
+    def _key(goal: str, cwd: str, planner: str) -> Tuple[str, str, str, str]:
+        """Plans are only reused for the same goal, directory, OS and planner"""
+        return (_canonical_goal(goal), cwd, sys.platform, planner)
+    
+    def lookup(self, goal: str, cwd: str, planner: str = "") -> Optional[PlanningResult]:
+        """Return a remembered plan for this goal, if any"""
+        key = self._key(goal, cwd, planner)
+        oldest = time.time() - self.max_age if self.max_age is not None else float("-inf")
+        with self.lock:
+            row = self._conn.execute(
+                """
+                SELECT plan_json FROM plans
+                WHERE goal = ? AND cwd = ? AND os = ? AND planner = ? AND remembered_at >= ?
+                """,
+                key + (oldest,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE plans SET last_used = ? WHERE goal = ? AND cwd = ? AND os = ? AND planner = ?",
+                (time.time(),) + key
+            )
+            self._conn.commit()
         
         try:
-            response = self._call_openai(prompt)
-            return self._parse_response(response)
+            return PlanningResult.from_dict(_json_loads(row[0]))
         except Exception as e:
-            logger.error(f"OpenAI API error: {e}")
-            return self._fallback_plan(user_request)
+            logger.warning(f"Ignoring unreadable remembered plan: {e}")
+            return None
+    
+    def remember(self, goal: str, cwd: str, plan: PlanningResult, planner: str = ""):
+        """Store a plan that executed successfully, evicting the least used ones"""
+        key = self._key(goal, cwd, planner)
+        now = time.time()
+        with self.lock:
+            self._conn.execute(
+                """
+                INSERT INTO plans (goal, cwd, os, planner, plan_json, freq, last_used, remembered_at)
+                VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT (goal, cwd, os, planner) DO UPDATE SET
+                    plan_json = excluded.plan_json,
+                    freq = freq + 1,
+                    last_used = excluded.last_used,
+                    remembered_at = excluded.remembered_at
+                """,
+                key + (_json_dumps(plan.to_dict()), now, now)
+            )
+            # LFU eviction, oldest first among equally used plans
+            self._conn.execute(
+                """
+                DELETE FROM plans WHERE rowid IN (
+                    SELECT rowid FROM plans
+                    ORDER BY freq DESC, last_used DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_plans,)
+            )
+            self._conn.commit()
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self._conn.close()
+
+# ======================
+# AI Command Planner
+# ======================
+
+class _StepStreamParser:
+    """Picks complete step objects out of a plan's JSON while it streams in"""
     
-    def _build_prompt(self, user_request: str, context: Dict[str, Any]) -> str:
-        """Build the prompt for OpenAI"""
-        return f"""
+    __slots__ = (
+        "text", "_pos", "_stack", "_in_string", "_escape", "_string_start",
+        "_last_key", "_steps_depth", "_step_start"
+    )
+    
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._stack = []  # open '{' and '[' characters
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key = None  # most recent string seen in the top-level object
+        self._steps_depth = None  # stack depth inside the "steps" array
+        self._step_start = None
+    
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Add streamed text and return the step objects it completed"""
+        self.text += chunk
+        text = self.text
+        steps = []
+        
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_key = text[self._string_start + 1:i]
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == "{":
+                if self._steps_depth is not None and len(self._stack) == self._steps_depth:
+                    self._step_start = i
+                self._stack.append(char)
+            elif char == "[":
+                self._stack.append(char)
+                if len(self._stack) == 2 and self._last_key == "steps":
+                    self._steps_depth = 2
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if self._steps_depth is None:
+                    continue
+                if char == "}" and self._step_start is not None and len(self._stack) == self._steps_depth:
+                    steps.append(_json_loads(text[self._step_start:i + 1]))
+                    self._step_start = None
+                elif char == "]" and len(self._stack) < self._steps_depth:
+                    self._steps_depth = None
+        
+        self._pos = len(text)
+        return steps
+
+@functools.lru_cache(maxsize=8)
+def _get_http_session(api_key: str, base_url: str):
+    """Return the keep-alive HTTP session for one API endpoint and key"""
+    # Imported here so CLI paths that never plan (--help, argument
+    # errors) don't pay for loading requests
+    import requests
+    from requests.adapters import HTTPAdapter
+    
+    # Keep-alive session so repeated plans reuse one TCP/TLS connection.
+    # Plans only ever go to one host, so one small pool is enough.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    })
+    return session
+
+class OpenAIPlanner:
+    """Uses OpenAI API to generate command plans"""
+    
+    __slots__ = (
+        "api_key", "base_url", "model", "plan_cache_size", "_plan_cache", "_session",
+        "_request_usage"
+    )
+    
+    # Static part of the prompt, sent as the system message so every request
+    # starts with the same prefix and provider-side prompt caching can reuse it
+    PROMPT_INSTRUCTIONS = """
 You are a helpful AI assistant that converts natural language requests into safe shell commands.
-Current directory: {context.get('cwd', os.getcwd())}
-User request: {user_request}
 
 Generate a step-by-step plan with:
 1. Each command to execute
@@ -427,91 +1086,395 @@ Generate a step-by-step plan with:
 5. Alternative safer commands if applicable
 
 Format as JSON:
-{{
+{
     "steps": [
-        {{
+        {
             "command": "command to run",
             "reasoning": "why this command",
             "risk_level": "safe|caution|dangerous|critical",
             "expected_output": "what to expect",
             "alternatives": ["safer option 1", "safer option 2"]
-        }}
+        }
     ],
     "overall_risk": "safe|caution|dangerous|critical",
     "requires_confirmation": true|false,
     "estimated_time": "time estimate",
     "success_criteria": ["criteria1", "criteria2"]
-}}
+}
 """
     
-    def _call_openai(self, prompt: str) -> str:
+    # Patterns used by _parse_simple_commands when the API is unavailable
+    _DIR_RE = re.compile(r'(?:make a dir|create a directory)\s+(?:named|called)\s+([a-zA-Z0-9/_\-\.]+)')
+    _FILE_RE = re.compile(r'make a (\w+) file (?:named|called) ([a-zA-Z0-9/_\-\.]+\.\w+)')
+    _GENERIC_FILE_RE = re.compile(r'make a file (?:named|called) ([a-zA-Z0-9/_\-\.]+\.\w+)')
+    _CONTENT_RE = re.compile(r"(?:file (?:named|called) ([a-zA-Z0-9/_\-\.]+\.\w+)|([a-zA-Z0-9/_\-\.]+\.\w+))\s+with\s+'([^']+)'")
+    _CD_RE = re.compile(r'(?:to|into)\s+(\S+)')
+    
+    # Keyword -> action for the simple file commands. The lookahead finds
+    # every keyword occurring anywhere in the request in a single scan,
+    # matching the substring checks this replaced (so "ls" still hits "calls")
+    _KEYWORD_ACTIONS = {
+        "list files": "ls",
+        "ls": "ls",
+        "change directory": "cd",
+        "cd": "cd",
+        "copy file": "cp",
+        "cp": "cp",
+        "move file": "mv",
+        "mv": "mv",
+        "delete file": "rm",
+        "remove file": "rm",
+        "rm": "rm"
+    }
+    _KEYWORD_RE = re.compile("(?=(" + "|".join(map(re.escape, _KEYWORD_ACTIONS)) + "))")
+    
+    # Every pattern above needs one of these substrings, so a request with
+    # none of them can skip straight to the default command
+    _PREFILTER_RE = re.compile("|".join(
+        ["make a ", "create a directory", "with"] + [re.escape(k) for k in _KEYWORD_ACTIONS]
+    ))
+    
+    # Changes whenever the instructions do, so plans stored for an older
+    # prompt are not replayed
+    PROMPT_VERSION = hashlib.sha256(PROMPT_INSTRUCTIONS.encode()).hexdigest()[:12]
+    
+    def __init__(self, api_key: str, base_url: str = None, model: str = None):
+        self.api_key = api_key
+        self.base_url = base_url or "https://api.openai.com/v1"
+        self.model = model or "gpt-3.5-turbo"
+        self.plan_cache_size = 128
+        self._plan_cache = OrderedDict()
+        # Planners for the same endpoint and key share one connection pool
+        self._session = _get_http_session(self.api_key, self.base_url)
+        # Cleared once the server turns out to reject stream_options
+        self._request_usage = True
+        
+    def generate_plan(self, user_request: str, context: Dict[str, Any] = None) -> PlanningResult:
+        """Generate a command plan from natural language"""
+        context = context or {}
+        
+        # The prompt only depends on the request and cwd, so identical goals
+        # can reuse an earlier plan instead of another API round trip
+        cwd = context['cwd'] if 'cwd' in context else os.getcwd()
+        cache_key = (_canonical_goal(user_request), cwd)
+        cached_plan = self._get_cached_plan(cache_key)
+        if cached_plan is not None:
+            return cached_plan
+        
+        messages = self._build_messages(user_request, cwd)
+        usage = {}
+        
+        try:
+            response = self._call_openai(messages, usage=usage)
+            plan = self._parse_response(response)
+            self._record_usage(plan, usage)
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            return self._fallback_plan(user_request)
+        
+        self._cache_plan(cache_key, plan)
+        return plan
+    
+    def stream_plan(self, user_request: str, context: Dict[str, Any] = None,
+                    on_step=None) -> PlanningResult:
+        """Generate a command plan, passing each step to on_step as soon as it arrives
+        
+        Returns the complete plan once the response has finished. If the
+        response breaks off after some steps were already handed out, the
+        plan holds just those steps and is marked as a fallback.
+        """
+        context = context or {}
+        cwd = context['cwd'] if 'cwd' in context else os.getcwd()
+        cache_key = (_canonical_goal(user_request), cwd)
+        
+        plan = self._get_cached_plan(cache_key)
+        if plan is not None:
+            if on_step is not None:
+                for step in plan.steps:
+                    on_step(step)
+            return plan
+        
+        parser = _StepStreamParser()
+        steps = []
+        usage = {}
+        try:
+            for text in self._stream_openai(self._build_messages(user_request, cwd), usage=usage):
+                for step_data in parser.feed(text):
+                    step = self._parse_step_data(step_data)
+                    steps.append(step)
+                    if on_step is not None:
+                        on_step(step)
+            plan = self._parse_response(parser.text)
+            self._record_usage(plan, usage)
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            if steps:
+                return self._partial_plan(steps)
+            plan = self._fallback_plan(user_request)
+            if on_step is not None:
+                for step in plan.steps:
+                    on_step(step)
+            return plan
+        
+        # Steps that were already handed out can't be taken back
+        if len(plan.steps) != len(steps):
+            logger.warning("Streamed steps differ from the final plan")
+            return self._partial_plan(steps)
+        
+        self._cache_plan(cache_key, plan)
+        return plan
+    
+    def generate_plans_batch(self, user_requests: List[str], context: Dict[str, Any] = None) -> List[PlanningResult]:
+        """Generate plans for several requests with a single API call
+        
+        Plans come back in the same order as the requests. Cached requests
+        are left out of the call; requests the response doesn't cover fall
+        back to local parsing like generate_plan does.
+        """
+        context = context or {}
+        cwd = context['cwd'] if 'cwd' in context else os.getcwd()
+        
+        plans: List[Optional[PlanningResult]] = []
+        # Cache key -> positions of the uncached requests, so a request that
+        # appears twice is only planned once
+        missing: Dict[Tuple[str, str], List[int]] = OrderedDict()
+        for index, user_request in enumerate(user_requests):
+            cache_key = (_canonical_goal(user_request), cwd)
+            plan = None if cache_key in missing else self._get_cached_plan(cache_key)
+            plans.append(plan)
+            if plan is None:
+                missing.setdefault(cache_key, []).append(index)
+        
+        if len(missing) == 1:
+            (indexes,) = missing.values()
+            plan = self.generate_plan(user_requests[indexes[0]], context)
+            for index in indexes:
+                plans[index] = plan if index == indexes[0] else copy.deepcopy(plan)
+        elif missing:
+            batch = [user_requests[indexes[0]] for indexes in missing.values()]
+            try:
+                # Leave each plan the same token budget as a single request
+                response = self._call_openai(self._build_batch_messages(batch, cwd), 1000 * len(batch))
+                plan_data = _json_loads(response)["plans"]
+            except Exception as e:
+                logger.error(f"OpenAI API error: {e}")
+                plan_data = []
+            
+            for position, (cache_key, indexes) in enumerate(missing.items()):
+                user_request = batch[position]
+                try:
+                    plan = self._parse_plan_data(plan_data[position])
+                    self._cache_plan(cache_key, plan)
+                except Exception as e:
+                    logger.error(f"Error parsing batched plan for {user_request!r}: {e}")
+                    plan = self._fallback_plan(user_request)
+                for index in indexes:
+                    plans[index] = plan if index == indexes[0] else copy.deepcopy(plan)
+        
+        return plans
+    
+    def _get_cached_plan(self, cache_key: Tuple[str, str]) -> Optional[PlanningResult]:
+        """Return a copy of a cached plan, if any"""
+        cached_plan = self._plan_cache.get(cache_key)
+        if cached_plan is None:
+            return None
+        self._plan_cache.move_to_end(cache_key)
+        logger.info("Using cached plan")
+        return copy.deepcopy(cached_plan)
+    
+    def _cache_plan(self, cache_key: Tuple[str, str], plan: PlanningResult):
+        """Cache a plan from the API, evicting the least recently used one"""
+        # Only API plans are cached; fallbacks should be retried next time
+        cached_plan = copy.deepcopy(plan)
+        # Reusing the plan costs no tokens
+        cached_plan.prompt_tokens = cached_plan.cached_tokens = 0
+        self._plan_cache[cache_key] = cached_plan
+        if len(self._plan_cache) > self.plan_cache_size:
+            self._plan_cache.popitem(last=False)
+    
+    async def generate_plan_async(self, user_request: str, context: Dict[str, Any] = None) -> PlanningResult:
+        """Generate a command plan without blocking the running event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.generate_plan, user_request, context)
+    
+    def _build_messages(self, user_request: str, cwd: str) -> List[Dict[str, str]]:
+        """Build the chat messages for OpenAI"""
+        return [
+            {"role": "system", "content": self.PROMPT_INSTRUCTIONS},
+            {"role": "user", "content": f"Current directory: {cwd}\nUser request: {user_request}\n"}
+        ]
+    
+    def _build_batch_messages(self, user_requests: List[str], cwd: str) -> List[Dict[str, str]]:
+        """Build the chat messages for planning several requests at once"""
+        return [
+            {"role": "system", "content": self.PROMPT_INSTRUCTIONS},
+            {"role": "user", "content": (
+                f"Current directory: {cwd}\n"
+                f"User requests: {_json_dumps(user_requests)}\n"
+                'Respond with {"plans": [...]}, containing one plan in the format above '
+                "for each request, in the same order.\n"
+            )}
+        ]
+    
+    def _call_openai(self, messages: List[Dict[str, str]], max_tokens: int = 1000,
+                     usage: Optional[Dict[str, Any]] = None) -> str:
         """Call OpenAI API"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        import requests
+        
+        content = "".join(self._stream_openai(messages, max_tokens, usage))
+        
+        # Check if response is empty
+        if not content.strip():
+            raise requests.RequestException("Empty response from API")
+        
+        return content
+    
+    def _stream_openai(self, messages: List[Dict[str, str]], max_tokens: int = 1000,
+                       usage: Optional[Dict[str, Any]] = None):
+        """Yield completion text from the OpenAI API as it is generated
+        
+        If a usage dict is given, it is filled with the token usage the API
+        reports for the request.
+        """
+        import requests
         
         data = {
             "model": self.model,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": messages,
             "temperature": 0.3,
-            "max_tokens": 1000
+            "max_tokens": max_tokens,
+            "stream": True
         }
+        if self._request_usage:
+            # Ask for a final chunk with token usage, including cache hits
+            data["stream_options"] = {"include_usage": True}
         
-        response = requests.post(
-            f"{self.base_url}/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        response.raise_for_status()
+        url = f"{self.base_url}/chat/completions"
+        response = self._session.post(url, json=data, timeout=30, stream=True)
+        if (response.status_code in (400, 422) and "stream_options" in data
+                and "stream_options" in response.text):
+            # Some OpenAI-compatible servers reject fields they don't know
+            # (pydantic-based ones with 422). Usage reporting must never cost
+            # the plan, so retry without it; other client errors fail as before.
+            response.close()
+            del data["stream_options"]
+            response = self._session.post(url, json=data, timeout=30, stream=True)
+            if response.ok:
+                self._request_usage = False
         
-        # Check if response is empty
-        if not response.text.strip():
-            raise requests.RequestException("Empty response from API")
-        
-        try:
-            return response.json()["choices"][0]["message"]["content"]
-        except (KeyError, ValueError) as e:
-            raise requests.RequestException(f"Invalid JSON response from API: {e}")
+        with response:
+            response.raise_for_status()
+            
+            # Some OpenAI-compatible servers ignore "stream" and reply with a
+            # regular JSON body
+            if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                try:
+                    body = response.json()
+                    if usage is not None:
+                        usage.update(body.get("usage") or {})
+                    yield body["choices"][0]["message"]["content"]
+                except (KeyError, IndexError, ValueError) as e:
+                    raise requests.RequestException(f"Invalid JSON response from API: {e}")
+                return
+            
+            # Server-sent events: one "data: {...}" line per chunk
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                payload = line[len(b"data:"):].strip()
+                if payload == b"[DONE]":
+                    break
+                try:
+                    chunk = _json_loads(payload)
+                except ValueError as e:
+                    raise requests.RequestException(f"Invalid stream chunk from API: {e}")
+                if usage is not None and chunk.get("usage"):
+                    usage.update(chunk["usage"])
+                for choice in chunk.get("choices") or []:
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        yield text
+    
+    def close(self):
+        """Close the pooled HTTP connections"""
+        # Other planners may share the session; a closed requests.Session
+        # just opens new connections on its next request
+        self._session.close()
+    
+    @property
+    def plan_key(self) -> str:
+        """Identifies the model and prompt that produce this planner's plans"""
+        return f"{self.model}@{self.PROMPT_VERSION}"
+    
+    @staticmethod
+    def _record_usage(plan: PlanningResult, usage: Dict[str, Any]):
+        """Copy the prompt token counts of an API response onto its plan"""
+        plan.prompt_tokens = usage.get("prompt_tokens") or 0
+        plan.cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
     
     def _parse_response(self, response: str) -> PlanningResult:
         """Parse OpenAI response into PlanningResult"""
         try:
-            data = json.loads(response)
-            
-            steps = []
-            for step_data in data["steps"]:
-                step = CommandStep(
-                    command=step_data["command"],
-                    reasoning=step_data["reasoning"],
-                    risk_level=CommandRisk(step_data["risk_level"]),
-                    expected_output=step_data["expected_output"],
-                    alternatives=step_data.get("alternatives", [])
-                )
-                steps.append(step)
-            
-            # Override risk if any step is dangerous
-            risk_values = ["safe", "caution", "dangerous", "critical"]
-            max_risk = max(steps, key=lambda s: risk_values.index(s.risk_level.value))
-            overall_risk = max_risk.risk_level
-            
-            requires_confirmation = any(step.risk_level in [CommandRisk.DANGEROUS, CommandRisk.CRITICAL] for step in steps)
-            
-            return PlanningResult(
-                steps=steps,
-                overall_risk=overall_risk,
-                requires_confirmation=requires_confirmation,
-                estimated_time=data.get("estimated_time", "unknown"),
-                success_criteria=data.get("success_criteria", [])
-            )
-            
+            return self._parse_plan_data(_json_loads(response))
         except Exception as e:
             logger.error(f"Error parsing response: {e}")
             # Re-raise the exception so it's caught in generate_plan which has the user request
             raise
     
+    def _parse_plan_data(self, data: Dict[str, Any]) -> PlanningResult:
+        """Build a PlanningResult from one decoded plan object"""
+        steps = []
+        # Track the highest risk while building the steps instead of
+        # scanning them again afterwards
+        overall_risk = None
+        max_rank = -1
+        for step_data in data["steps"]:
+            step = self._parse_step_data(step_data)
+            steps.append(step)
+            
+            risk = step.risk_level
+            rank = _RISK_RANK[risk]
+            if rank > max_rank:
+                overall_risk, max_rank = risk, rank
+        
+        if not steps:
+            raise ValueError("Plan contains no steps")
+        
+        # Dangerous or critical steps need confirmation
+        requires_confirmation = max_rank >= _RISK_RANK[CommandRisk.DANGEROUS]
+        
+        return PlanningResult(
+            steps=steps,
+            overall_risk=overall_risk,
+            requires_confirmation=requires_confirmation,
+            estimated_time=data.get("estimated_time", "unknown"),
+            success_criteria=data.get("success_criteria", [])
+        )
+    
+    @staticmethod
+    def _parse_step_data(step_data: Dict[str, Any]) -> CommandStep:
+        """Build a CommandStep from one decoded step object"""
+        return CommandStep(
+            command=step_data["command"],
+            reasoning=step_data["reasoning"],
+            risk_level=_RISK_BY_VALUE[step_data["risk_level"]],
+            expected_output=step_data["expected_output"],
+            alternatives=step_data.get("alternatives", [])
+        )
+    
+    @staticmethod
+    def _partial_plan(steps: List[CommandStep]) -> PlanningResult:
+        """Wrap the steps of an incomplete streamed response in a plan"""
+        overall_risk = max((step.risk_level for step in steps), key=_RISK_RANK.__getitem__)
+        return PlanningResult(
+            steps=steps,
+            overall_risk=overall_risk,
+            requires_confirmation=_RISK_RANK[overall_risk] >= _RISK_RANK[CommandRisk.DANGEROUS],
+            estimated_time="unknown",
+            success_criteria=[],
+            is_fallback=True
+        )
+    
     def _fallback_plan(self, user_request: str) -> PlanningResult:
         """Generate a fallback plan when OpenAI fails"""
         # Try to parse simple commands locally
@@ -531,7 +1494,8 @@ Format as JSON:
                 overall_risk=CommandRisk.SAFE,
                 requires_confirmation=False,
                 estimated_time="immediate",
-                success_criteria=[f"Successfully executed: {', '.join(commands)}"]
+                success_criteria=[f"Successfully executed: {', '.join(commands)}"],
+                is_fallback=True
             )
         else:
             # Fallback to generic message if parsing fails
@@ -545,28 +1509,25 @@ Format as JSON:
                 overall_risk=CommandRisk.SAFE,
                 requires_confirmation=False,
                 estimated_time="immediate",
-                success_criteria=["User provides clearer instructions"]
+                success_criteria=["User provides clearer instructions"],
+                is_fallback=True
             )
     
     def _parse_simple_commands(self, user_request: str) -> List[str]:
         """Parse simple commands from user request when AI is unavailable"""
         request_lower = user_request.lower().strip()
         logger.info(f"Parsing user request: {user_request}")
-        commands = []
         
-        # Handle directory creation with full path support
-        # Look for patterns like "make a dir named project/src"
-        dir_patterns = [
-            r'(?:make a dir|create a directory)\s+(?:named|called)\s+([a-zA-Z0-9/_\-\.]+)',
-        ]
+        if not self._PREFILTER_RE.search(request_lower):
+            logger.info("No specific commands found, using default mkdir")
+            return ["mkdir new_directory"]
         
-        # Also handle the case where directories are listed with "and make a dir"
-        # Split the request to handle multiple directory creation commands
-        import re
+        commands = []
         
-        # Find all directory creation commands
-        dir_pattern = r'(?:make a dir|create a directory)\s+(?:named|called)\s+([a-zA-Z0-9/_\-\.]+)'
-        dir_matches = re.findall(dir_pattern, request_lower)
+        # Handle directory creation with full path support
+        # Look for patterns like "make a dir named project/src"; a request can
+        # contain several of them
+        dir_matches = self._DIR_RE.findall(request_lower)
         
         # Remove duplicates and filter out "named" which is a false positive
         seen = set()
@@ -578,8 +1539,7 @@ Format as JSON:
         
         # Handle file creation with extension and full path support
         # Look for patterns like "make a txt file named project/README.md"
-        file_pattern = r'make a (\w+) file (?:named|called) ([a-zA-Z0-9/_\-\.]+\.\w+)'
-        file_matches = re.findall(file_pattern, request_lower)
+        file_matches = self._FILE_RE.findall(request_lower)
         
         for ext, file_path in file_matches:
             # Don't modify the extension if it's already correct
@@ -589,14 +1549,13 @@ Format as JSON:
             commands.append(f"touch {file_path}")
         
         # Handle generic file creation without extension specification
-        generic_file_pattern = r'make a file (?:named|called) ([a-zA-Z0-9/_\-\.]+\.\w+)'
-        generic_matches = re.findall(generic_file_pattern, request_lower)
+        generic_matches = self._GENERIC_FILE_RE.findall(request_lower)
         for file_path in generic_matches:
             logger.info(f"Found generic file path: {file_path}")
             commands.append(f"touch {file_path}")
         
         # Handle writing content to file
-        content_matches = re.findall(r"(?:file (?:named|called) ([a-zA-Z0-9/_\-\.]+\.\w+)|([a-zA-Z0-9/_\-\.]+\.\w+))\s+with\s+'([^']+)'", request_lower)
+        content_matches = self._CONTENT_RE.findall(request_lower)
         for match in content_matches:
             file_name = match[0] if match[0] else match[1]
             content = match[2]
@@ -604,27 +1563,29 @@ Format as JSON:
                 logger.info(f"Found file name: {file_name} with content: {content}")
                 commands.append(f"echo '{content}' > {file_name}")
         
+        actions = {self._KEYWORD_ACTIONS[keyword] for keyword in self._KEYWORD_RE.findall(request_lower)}
+        
         # Handle directory listing
-        if "list files" in request_lower or "ls" in request_lower:
+        if "ls" in actions:
             commands.append("ls")
         
         # Handle directory change
-        if "change directory" in request_lower or "cd" in request_lower:
-            match = re.search(r'(?:to|into)\s+(\S+)', request_lower)
+        if "cd" in actions:
+            match = self._CD_RE.search(request_lower)
             if match:
                 dir_name = match.group(1)
                 commands.append(f"cd {dir_name}")
         
         # Handle file copying
-        if "copy file" in request_lower or "cp" in request_lower:
+        if "cp" in actions:
             commands.append("cp source_file destination_file")
         
         # Handle file moving
-        if "move file" in request_lower or "mv" in request_lower:
+        if "mv" in actions:
             commands.append("mv source_file destination_file")
         
         # Handle file deletion
-        if "delete file" in request_lower or "remove file" in request_lower or "rm" in request_lower:
+        if "rm" in actions:
             commands.append("rm filename")
         
         # If no commands were parsed, return default mkdir command
@@ -634,82 +1595,371 @@ Format as JSON:
         
         return commands
 
+class TrivialPlanner:
+    """Plans goals that map directly onto a single read-only command, without the LLM"""
+    
+    # Only commands whose output is safe to echo into the results JSON;
+    # env, for example, would include OPENAI_API_KEY
+    TRIVIAL_GOALS = {
+        "list files": "ls -la",
+        "list all files": "ls -la",
+        "list the files": "ls -la",
+        "show files": "ls -la",
+        "list directory": "ls -la",
+        "list directory contents": "ls -la",
+        "print working directory": "pwd",
+        "current directory": "pwd",
+        "current dir": "pwd",
+        "show current directory": "pwd",
+        "where am i": "pwd",
+        "who am i": "whoami",
+        "whoami": "whoami",
+        "show current user": "whoami",
+        "show date": "date",
+        "current date": "date",
+        "what time is it": "date",
+        "show disk usage": "df -h",
+        "disk usage": "df -h",
+        "show disk space": "df -h",
+        "list processes": "ps aux",
+        "show running processes": "ps aux",
+        "show hostname": "hostname",
+        "show uptime": "uptime",
+        "git status": "git status",
+        "show git status": "git status",
+        "show git log": "git log --oneline -n 20",
+        "show python version": "python3 --version",
+    }
+    
+    _WORD_RE = re.compile(r"[a-z0-9]+")
+    
+    @classmethod
+    def normalize(cls, goal: str) -> str:
+        """Lowercase the goal and drop punctuation and extra whitespace"""
+        words = cls._WORD_RE.findall(goal.lower())
+        if words and words[0] == "please":
+            words = words[1:]
+        return " ".join(words)
+    
+    @classmethod
+    def plan(cls, goal: str) -> Optional[PlanningResult]:
+        """Return a one-step plan for a whitelisted goal, or None"""
+        command = cls.TRIVIAL_GOALS.get(cls.normalize(goal))
+        if command is None:
+            return None
+        
+        risk = AISafetyChecker.assess_risk(command)
+        return PlanningResult(
+            steps=[CommandStep(
+                command=command,
+                reasoning="Direct mapping for a common request",
+                risk_level=risk,
+                expected_output="Command output"
+            )],
+            overall_risk=risk,
+            requires_confirmation=False,
+            estimated_time="immediate",
+            success_criteria=[f"Successfully executed: {command}"]
+        )
+
 class CommandExecutor:
     """Executes commands with safety checks and feedback"""
     
+    __slots__ = ("pty_manager", "step_timeout", "recovery_timeout")
+    
+    # Terminal escape sequences (colors, bracketed paste) stripped from PTY output
+    _ANSI_RE = re.compile(rb"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07]*\x07|\x1b[=>]")
+    
+    # Plan steps must behave the same for every user, so the shell skips rc
+    # files; aliases such as rm='rm -i' would otherwise wait on hidden prompts
+    SHELL_ARGS = ("--norc", "--noprofile")
+    
     def __init__(self, pty_manager):
         self.pty_manager = pty_manager
+        self.step_timeout = 10
+        # Seconds a timed-out command gets to stop before the shell is restarted
+        self.recovery_timeout = 2
     
     def create_session(self, session_id: str) -> bool:
         """Create a new PTY session"""
-        return self.pty_manager.create_session(session_id)
+        return self.pty_manager.create_session(session_id, shell_args=self.SHELL_ARGS)
     
-    def execute_plan(self, plan: PlanningResult, session_id: str) -> List[Dict[str, Any]]:
-        """Execute a command plan step by step"""
-        results = []
+    def _run_in_session(self, session: PTYSession, command: str) -> Tuple[Optional[int], str]:
+        """Run a command in the session's shell and wait for it to finish
         
-        for i, step in enumerate(plan.steps):
-            logger.info(f"Executing step {i+1}: {step.command}")
-            
-            # Safety check
-            risk = AISafetyChecker.assess_risk(step.command)
-            warnings = AISafetyChecker.get_warnings(step.command)
-            
-            result = {
-                "step": i + 1,
-                "command": step.command,
-                "reasoning": step.reasoning,
-                "risk_level": risk.value,
-                "warnings": warnings,
-                "success": False,
-                "output": ""
-            }
+        Returns the exit code (None on timeout or if the shell went away)
+        and the command's output.
+        """
+        # The command is wrapped in begin/end markers. Printing each marker in
+        # two parts means the echoed command line never contains it.
+        token = os.urandom(8).hex()
+        begin = f"__CMD_BEGIN_{token}".encode()
+        end = f"__CMD_END_{token}:".encode()
+        start = len(session.output_buffer)
+        
+        line = (
+            f"printf '%s%s\\n' __CMD_BEGIN_ {token}; "
+            f"eval {shlex.quote(command)}; "
+            f"printf '\\n%s%s:%d\\n' __CMD_END_ {token} $?"
+        )
+        if not session.execute_command(line):
+            return None, "Failed to write command to PTY session"
+        
+        found = self._wait_for_marker(session, start, end, self.step_timeout)
+        if found is None:
+            if not session.is_running:
+                return None, "PTY session exited"
+            self._stop_command(session, token, start, end)
+            return None, "Command timed out"
+        output, end_at, newline = found
+        
+        begin_at = output.find(begin)
+        body_start = output.find(b"\n", begin_at) + 1 if begin_at != -1 else 0
+        body = self._ANSI_RE.sub(b"", bytes(output[body_start:end_at]))
+        exit_code = int(output[end_at + len(end):newline].strip())
+        text = body.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "")
+        return exit_code, text.strip()
+    
+    @staticmethod
+    def _wait_for_marker(session: PTYSession, start: int, end: bytes,
+                         timeout: float) -> Optional[Tuple[bytearray, int, int]]:
+        """Wait for the end marker line to appear in the output after start
+        
+        Returns the output since start with the positions of the marker and
+        of the newline after it, or None on timeout or if the shell exited.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            output = session.output_buffer[start:]
+            end_at = output.find(end)
+            if end_at != -1:
+                newline = output.find(b"\n", end_at)
+                if newline != -1:
+                    return output, end_at, newline
             
-            # Use subprocess for reliable command execution instead of PTY
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not session.is_running:
+                return None
+            session.read_output(min(remaining, 0.5))
+    
+    def _stop_command(self, session: PTYSession, token: str, start: int, end: bytes):
+        """Stop a command that outlived its timeout, restarting the shell if it stays stuck"""
+        try:
+            foreground = os.tcgetpgrp(session.master_fd)
+        except (OSError, TypeError):
+            foreground = None
+        
+        if foreground is not None and foreground != session.process.pid:
+            # A job such as a pager holds the terminal and may ignore Ctrl-C.
+            # Once it is killed the shell goes on to print the end marker.
             try:
-                import subprocess
-                completed_process = subprocess.run(
-                    step.command,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    timeout=10
-                )
-                
-                if completed_process.returncode == 0:
-                    result["success"] = True
-                    output = completed_process.stdout.strip()
-                    if output:
-                        result["output"] = output
-                    else:
-                        result["output"] = "Command executed successfully"
-                else:
-                    result["success"] = False
-                    error_output = completed_process.stderr.strip()
-                    if error_output:
-                        result["output"] = f"Command failed: {error_output}"
-                    else:
-                        result["output"] = "Command failed with non-zero exit code"
-                        
-            except subprocess.TimeoutExpired:
-                result["output"] = "Command timed out"
-            except Exception as e:
-                result["output"] = f"Failed to execute command: {str(e)}"
-            
-            results.append(result)
+                os.killpg(foreground, signal.SIGKILL)
+            except OSError:
+                pass
+        else:
+            # The shell itself is busy, e.g. in a builtin loop. Ctrl-C drops
+            # the rest of the command line, so print the end marker again.
+            session.send_control_character('C')
+            session.execute_command(f"printf '\\n%s%s:%d\\n' __CMD_END_ {token} 130")
+        
+        if self._wait_for_marker(session, start, end, self.recovery_timeout) is None and session.is_running:
+            logger.warning(f"PTY session {session.session_id} is not responding; restarting it")
+            session.restart()
+    
+    def execute_plan(self, plan: PlanningResult, session_id: str,
+                     cwd: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Execute a command plan step by step, starting in cwd (default: our own)"""
+        return self.execute_steps(plan.steps, session_id, cwd)
+    
+    def execute_steps(self, steps: List[CommandStep], session_id: str,
+                      cwd: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Execute plan steps in order, starting in cwd (default: our own)"""
+        results = []
+        
+        # Steps run in the persistent shell, so state such as cd carries over
+        # between the steps of one plan, but not from an earlier plan
+        session = self.enter_directory(session_id, cwd)
+        
+        for i, step in enumerate(steps):
+            results.append(self._execute_step(i, step, session, session_id))
             
         return results
+    
+    def enter_directory(self, session_id: str, cwd: Optional[str] = None) -> Optional[PTYSession]:
+        """Move the session's shell to the directory plans were made for
+        
+        Creates the session if needed and returns it (None if it couldn't
+        be created).
+        """
+        session = self.pty_manager.get_session(session_id)
+        if session is None and self.create_session(session_id):
+            session = self.pty_manager.get_session(session_id)
+        if session is None:
+            return None
+        
+        if not session.is_running:
+            session.restart()
+        cwd = cwd or os.getcwd()
+        exit_code, output = self._run_in_session(session, f"cd -- {shlex.quote(cwd)}")
+        if exit_code != 0:
+            logger.warning(f"Could not change PTY session {session_id} to {cwd}: {output}")
+        return session
+    
+    def execute_step(self, index: int, step: CommandStep, session_id: str) -> Dict[str, Any]:
+        """Execute one plan step, index being its position in the plan"""
+        session = self.pty_manager.get_session(session_id)
+        if session is None and self.create_session(session_id):
+            session = self.pty_manager.get_session(session_id)
+        return self._execute_step(index, step, session, session_id)
+    
+    def _execute_step(self, i: int, step: CommandStep, session: Optional[PTYSession],
+                      session_id: str) -> Dict[str, Any]:
+        """Execute a single plan step in a PTY session"""
+        logger.info(f"Executing step {i+1}: {step.command}")
+        
+        # Safety check
+        risk, warnings = AISafetyChecker.classify(step.command)
+        
+        result = {
+            "step": i + 1,
+            "command": step.command,
+            "reasoning": step.reasoning,
+            "risk_level": risk.value,
+            "warnings": warnings,
+            "success": False,
+            "output": ""
+        }
+        
+        if session is None:
+            result["output"] = f"Failed to execute command: no PTY session {session_id}"
+            return result
+        
+        # An earlier step may have ended the shell (exit, exec, set -e); give
+        # this one a fresh shell instead of failing every step after it
+        if not session.is_running:
+            logger.warning(f"PTY session {session_id} has exited; restarting it")
+            if not session.restart():
+                result["output"] = f"Failed to execute command: could not restart PTY session {session_id}"
+                return result
+        
+        try:
+            exit_code, output = self._run_in_session(session, step.command)
+            
+            if exit_code == 0:
+                result["success"] = True
+                if output:
+                    result["output"] = output
+                else:
+                    result["output"] = "Command executed successfully"
+            elif exit_code is None:
+                result["output"] = output
+            else:
+                if output:
+                    result["output"] = f"Command failed: {output}"
+                else:
+                    result["output"] = "Command failed with non-zero exit code"
+                    
+        except Exception as e:
+            result["output"] = f"Failed to execute command: {str(e)}"
+        
+        return result
 
 class AICommandPlanner:
     """Main AI command planner that combines OpenAI planning with execution"""
     
-    def __init__(self, api_key: str, base_url: str = None, model: str = None):
+    def __init__(self, api_key: str, base_url: str = None, model: str = None,
+                 plan_memory: Optional[PlanMemory] = None):
         self.planner = OpenAIPlanner(api_key, base_url, model)
         self.executor = CommandExecutor(manager)
+        self.plan_memory = plan_memory
+    
+    def generate_plan(self, goal: str, context: Dict[str, Any] = None) -> PlanningResult:
+        """Generate a plan: direct mapping, then plan memory, then the LLM"""
+        context = context or {}
+        
+        # Goals that map straight onto one command don't need the LLM
+        plan = TrivialPlanner.plan(goal)
+        if plan is not None:
+            logger.info("Using direct plan for trivial goal")
+            return plan
+        
+        plan = self._remembered_plan(goal, context)
+        if plan is not None:
+            logger.info("Using remembered plan")
+            return plan
+        
+        return self.planner.generate_plan(goal, context)
+    
+    def stream_plan(self, goal: str, context: Dict[str, Any] = None, on_step=None) -> PlanningResult:
+        """Like generate_plan, but hands each step to on_step as soon as it is known"""
+        context = context or {}
+        
+        plan = TrivialPlanner.plan(goal)
+        if plan is None:
+            plan = self._remembered_plan(goal, context)
+        if plan is None:
+            return self.planner.stream_plan(goal, context, on_step)
+        
+        if on_step is not None:
+            for step in plan.steps:
+                on_step(step)
+        return plan
+    
+    def generate_plans_batch(self, goals: List[str], context: Dict[str, Any] = None) -> List[PlanningResult]:
+        """Generate plans for several goals, sending all LLM-bound goals in one request"""
+        context = context or {}
+        
+        plans: List[Optional[PlanningResult]] = []
+        for goal in goals:
+            plan = TrivialPlanner.plan(goal)
+            if plan is None:
+                plan = self._remembered_plan(goal, context)
+            plans.append(plan)
+        
+        pending = [index for index, plan in enumerate(plans) if plan is None]
+        if pending:
+            generated = self.planner.generate_plans_batch([goals[index] for index in pending], context)
+            for index, plan in zip(pending, generated):
+                plans[index] = plan
+        
+        return plans
+    
+    def _remembered_plan(self, goal: str, context: Dict[str, Any]) -> Optional[PlanningResult]:
+        """Look the goal up in plan memory, if any; a broken store just means no hit"""
+        if self.plan_memory is None:
+            return None
+        try:
+            return self.plan_memory.lookup(goal, context.get('cwd', os.getcwd()), self.planner.plan_key)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to look up remembered plan: {e}")
+            return None
+    
+    def remember_plan(self, goal: str, plan: PlanningResult, context: Dict[str, Any] = None):
+        """Record a plan that achieved its goal"""
+        # Locally parsed fallbacks are guesses; only keep real AI plans
+        if self.plan_memory is None or plan.is_fallback:
+            return
+        context = context or {}
+        try:
+            self.plan_memory.remember(goal, context.get('cwd', os.getcwd()), plan, self.planner.plan_key)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to remember plan: {e}")
     
     def set_pty_manager(self, pty_manager):
         """Set the PTY manager for command execution"""
         self.executor.pty_manager = pty_manager
+    
+    def close(self):
+        """Release the planner's HTTP session and plan memory"""
+        self.planner.close()
+        if self.plan_memory is not None:
+            self.plan_memory.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
 # ======================
 # Planning Loop
@@ -718,13 +1968,43 @@ class AICommandPlanner:
 class PlanningLoop:
     """Main planning loop that iterates until goals are achieved"""
     
+    __slots__ = ("planner", "max_iterations", "retry_delay", "max_retry_delay")
+    
+    # Failure output that suggests retrying the same plan may succeed. Only
+    # network and HTTP errors count; timeouts are left out because the
+    # executor's own "Command timed out" means the shell is stuck, and
+    # waiting for the full step timeout again won't help
+    _TRANSIENT_ERROR_RE = re.compile(
+        r"rate limit|too many requests|temporarily unavailable|"
+        r"try again|connection (?:reset|refused)|\b(?:429|503)\b",
+        re.IGNORECASE
+    )
+    
     def __init__(self, ai_planner: AICommandPlanner):
         self.planner = ai_planner
         self.max_iterations = 10
         self.retry_delay = 2
+        self.max_retry_delay = 30
         
     def execute_goal(self, goal: str, session_id: str, context: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Execute a goal through iterative planning and execution"""
+        """Execute a goal through iterative planning and execution
+        
+        Blocks until done, even when called from a running event loop;
+        async callers should await execute_goal_async instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.execute_goal_async(goal, session_id, context))
+        
+        # asyncio.run can't nest inside a running loop (async code, Jupyter),
+        # so give the goal its own loop on a worker thread
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, self.execute_goal_async(goal, session_id, context)).result()
+    
+    async def execute_goal_async(self, goal: str, session_id: str, context: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Async variant of execute_goal that keeps the event loop free while planning, executing and backing off"""
+        loop = asyncio.get_running_loop()
         context = context or {}
         iteration = 0
         results = []
@@ -736,7 +2016,7 @@ class PlanningLoop:
             
             # Generate plan
             try:
-                plan = self.planner.planner.generate_plan(goal, context)
+                plan = await loop.run_in_executor(None, self.planner.generate_plan, goal, context)
             except Exception as e:
                 logger.error(f"Failed to generate plan: {e}")
                 return {
@@ -756,7 +2036,9 @@ class PlanningLoop:
             
             # Execute plan
             try:
-                execution_results = self.planner.executor.execute_plan(plan, session_id)
+                execution_results = await loop.run_in_executor(
+                    None, self.planner.executor.execute_plan, plan, session_id, context.get('cwd')
+                )
             except Exception as e:
                 logger.error(f"Failed to execute plan: {e}")
                 return {
@@ -768,6 +2050,7 @@ class PlanningLoop:
             
             # Check if goal is achieved
             if self._check_goal_achievement(goal, execution_results, context):
+                self.planner.remember_plan(goal, plan, context)
                 return {
                     "status": "success",
                     "results": results,
@@ -783,8 +2066,20 @@ class PlanningLoop:
                 # Adjust context for retry
                 context = self._adjust_context_for_retry(goal, execution_results, context)
                 
-                # Wait before retry
-                time.sleep(self.retry_delay)
+                # A deterministic failure (bad syntax, missing file) would fail
+                # the same way again, so stop instead of sleeping and retrying
+                if not self._is_transient_failure(failed_steps):
+                    return {
+                        "status": "execution_failed_deterministic",
+                        "results": results,
+                        "error": context.get("last_error", "Unknown error"),
+                        "iterations": iteration + 1,
+                        "final_context": context
+                    }
+                
+                # Back off exponentially before retrying a transient failure
+                delay = min(self.retry_delay * 2 ** (context["retry_count"] - 1), self.max_retry_delay)
+                await asyncio.sleep(delay)
             
             iteration += 1
         
@@ -801,6 +2096,10 @@ class PlanningLoop:
         # In a real implementation, this would use AI to analyze outputs
         return all(r.get("success", False) for r in results)
     
+    def _is_transient_failure(self, failed_steps: List[Dict[str, Any]]) -> bool:
+        """Check whether any failed step looks like it could succeed on retry"""
+        return any(self._TRANSIENT_ERROR_RE.search(r.get("output", "")) for r in failed_steps)
+    
     def _adjust_context_for_retry(self, goal: str, results: List[Dict[str, Any]], context: Dict[str, Any]) -> Dict[str, Any]:
         """Adjust context based on failed execution"""
         # Update context with failure information
@@ -817,22 +2116,7 @@ class PlanningLoop:
     
     def _plan_to_dict(self, plan: PlanningResult) -> Dict[str, Any]:
         """Convert plan to dictionary for JSON serialization"""
-        return {
-            "steps": [
-                {
-                    "command": step.command,
-                    "reasoning": step.reasoning,
-                    "risk_level": step.risk_level.value,
-                    "expected_output": step.expected_output,
-                    "alternatives": step.alternatives
-                }
-                for step in plan.steps
-            ],
-            "overall_risk": plan.overall_risk.value,
-            "requires_confirmation": plan.requires_confirmation,
-            "estimated_time": plan.estimated_time,
-            "success_criteria": plan.success_criteria
-        }
+        return plan.to_dict()
 
 # ======================
 # Terminal AI Agent
@@ -841,85 +2125,90 @@ class PlanningLoop:
 class TerminalAIAgent:
     """Main Terminal AI Agent that orchestrates planning and execution"""
     
-    def __init__(self, api_key: str = None, base_url: str = None, model: str = None):
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "mock-key")
-        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
-        self.model = model or os.getenv("AI_MODEL")
-        self.planner = AICommandPlanner(self.api_key, self.base_url, self.model)
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = None,
+                 plan_memory: Optional[PlanMemory] = None, auto_yes: bool = False):
+        self.api_key = api_key or _DEFAULT_API_KEY or "mock-key"
+        self.base_url = base_url or _DEFAULT_BASE_URL
+        self.model = model or _DEFAULT_MODEL
+        self.planner = AICommandPlanner(self.api_key, self.base_url, self.model, plan_memory)
         self.todo_list: List[TodoItem] = []
+        self._todo_by_id: Dict[int, TodoItem] = {}
+        self.plan = None
+        # Run dangerous plans without asking for confirmation
+        self.auto_yes = auto_yes
+        # The PTY session is started by the executor when the first step
+        # runs, so planning-only use never spawns a shell
         self.session_id = "terminal-ai-agent"
-        
-        # Create PTY session
-        if not manager.get_session(self.session_id):
-            manager.create_session(self.session_id)
     
     def create_todo_list(self, goal: str) -> List[TodoItem]:
         """Create a to-do list from a natural language goal"""
         try:
             # Generate plan using AI
-            plan = self.planner.planner.generate_plan(goal)
+            plan = self.planner.generate_plan(goal)
+            self.plan = plan
             
             # Convert plan to todo items
-            self.todo_list = []
-            for i, step in enumerate(plan.steps):
-                todo_item = TodoItem(
-                    id=i + 1,
-                    command=step.command,
-                    reasoning=step.reasoning,
-                    risk_level=step.risk_level.value,
-                    status="pending"
-                )
-                self.todo_list.append(todo_item)
-            
+            self._set_todo_list(self._todo_items(plan))
             return self.todo_list
             
         except Exception as e:
             logger.error(f"Failed to create to-do list: {e}")
-            # Create a fallback todo item
-            fallback_item = TodoItem(
-                id=1,
-                command="echo 'Failed to generate plan. Please try again.'",
-                reasoning="Fallback due to error",
-                risk_level="safe",
+            self.plan = None
+            self._set_todo_list([dataclasses.replace(_FALLBACK_TODO)])
+            return self.todo_list
+    
+    def create_todo_lists_batch(self, goals: List[str]) -> List[List[TodoItem]]:
+        """Create to-do lists for several goals with a single planning request
+        
+        Unlike create_todo_list this doesn't change the agent's current
+        to-do list; errors propagate to the caller.
+        """
+        plans = self.planner.generate_plans_batch(goals)
+        return [self._todo_items(plan) for plan in plans]
+    
+    def _set_todo_list(self, items: List[TodoItem]):
+        """Replace the to-do list and rebuild its id index"""
+        self.todo_list = items
+        self._todo_by_id = {item.id: item for item in items}
+    
+    @staticmethod
+    def _todo_items(plan: PlanningResult) -> List[TodoItem]:
+        """Convert plan steps to to-do items"""
+        todo_list = []
+        for i, step in enumerate(plan.steps):
+            todo_item = TodoItem(
+                id=i + 1,
+                command=step.command,
+                reasoning=step.reasoning,
+                risk_level=step.risk_level.value,
                 status="pending"
             )
-            self.todo_list = [fallback_item]
-            return self.todo_list
+            todo_list.append(todo_item)
+        return todo_list
+    
+    @staticmethod
+    def _todo_step(item: TodoItem) -> CommandStep:
+        """Convert a to-do item back into a plan step"""
+        return CommandStep(
+            command=item.command,
+            reasoning=item.reasoning,
+            risk_level=_RISK_BY_VALUE[item.risk_level],
+            expected_output="",
+            alternatives=[]
+        )
     
     def update_todo_list(self, item_id: int, status: str, output: str = ""):
         """Update a todo item's status and output"""
-        for item in self.todo_list:
-            if item.id == item_id:
-                item.status = status
-                item.output = output
-                break
+        item = self._todo_by_id.get(item_id)
+        if item is not None:
+            item.status = status
+            item.output = output
     
     def execute_todo_list(self) -> List[Dict[str, Any]]:
         """Execute all items in the to-do list"""
-        results = []
-        
-        # Create a plan from the todo list
-        steps = []
-        for item in self.todo_list:
-            step = CommandStep(
-                command=item.command,
-                reasoning=item.reasoning,
-                risk_level=CommandRisk(item.risk_level),
-                expected_output="",
-                alternatives=[]
-            )
-            steps.append(step)
-        
-        plan = PlanningResult(
-            steps=steps,
-            overall_risk=CommandRisk.SAFE,
-            requires_confirmation=False,
-            estimated_time="unknown",
-            success_criteria=[]
-        )
-        
-        # Execute the plan
-        execution_results = self.planner.executor.execute_plan(plan, self.session_id)
+        # The executor takes the steps directly; no plan needs to be built
+        steps = [self._todo_step(item) for item in self.todo_list]
+        execution_results = self.planner.executor.execute_steps(steps, self.session_id)
         
         # Update todo list with results
         for i, result in enumerate(execution_results):
@@ -941,46 +2230,162 @@ class TerminalAIAgent:
         self.create_todo_list(goal)
         
         # Display to-do list
-        print("\n📝 To-Do List:")
-        for item in self.todo_list:
-            risk_icon = {
-                "safe": "✅",
-                "caution": "⚠️",
-                "dangerous": "🚨",
-                "critical": "💀"
-            }.get(item.risk_level, "❓")
-            print(f"  {item.id}. {risk_icon} {item.command}")
-            print(f"     Reasoning: {item.reasoning}")
-            print()
+        # Each section goes out in one write rather than a print per line
+        sys.stdout.write("\n📝 To-Do List:\n" + "".join(map(self._format_item, self.todo_list)))
         
         # Check for dangerous commands
-        dangerous_items = [item for item in self.todo_list if item.risk_level in ["dangerous", "critical"]]
-        if dangerous_items:
-            print("⚠️  WARNING: This plan contains potentially dangerous commands!")
-            response = input("\nDo you want to continue? (y/N): ")
-            if response.lower() != 'y':
-                return {"status": "cancelled", "message": "User cancelled execution"}
+        refusal = self._confirm_items(self.todo_list)
+        if refusal:
+            return {"status": "cancelled", "message": refusal}
         
         # Execute to-do list
         print("\n🚀 Executing to-do list...")
         results = self.execute_todo_list()
         
-        # Display results
-        print("\n📊 Execution Results:")
+        return self._finish_task(goal, results)
+    
+    def run_streaming(self, goal: str) -> Dict[str, Any]:
+        """Run a task, executing safe steps while the rest of the plan is still streaming
+        
+        Steps run in plan order. The first step that isn't safe ends early
+        execution: it and everything after it wait for the complete plan,
+        and for confirmation if any of them is dangerous.
+        """
+        print(f"🎯 Goal: {goal}")
+        print("=" * 50)
+        print("\n📝 To-Do List:")
+        
+        self._set_todo_list([])
+        pending = queue.Queue()
+        results = []
+        
+        def on_step(step: CommandStep):
+            item = TodoItem(
+                id=len(self.todo_list) + 1,
+                command=step.command,
+                reasoning=step.reasoning,
+                risk_level=step.risk_level.value,
+                status="pending"
+            )
+            self.todo_list.append(item)
+            self._todo_by_id[item.id] = item
+            sys.stdout.write(self._format_item(item))
+            pending.put((item, step))
+        
+        def execute_safe_steps():
+            # Start from the planning directory, not where an earlier task left the shell
+            self.planner.executor.enter_directory(self.session_id)
+            while True:
+                entry = pending.get()
+                if entry is None:
+                    return
+                item, step = entry
+                # Don't rely on the planner's own risk label for this
+                if step.risk_level != CommandRisk.SAFE or AISafetyChecker.assess_risk(step.command) != CommandRisk.SAFE:
+                    return
+                results.append(self._execute_item(item, step))
+        
+        consumer = threading.Thread(target=execute_safe_steps, daemon=True)
+        consumer.start()
+        try:
+            self.plan = self.planner.stream_plan(goal, on_step=on_step)
+        except Exception as e:
+            logger.error(f"Failed to create to-do list: {e}")
+            self.plan = None
+            if not self.todo_list:
+                on_step(self._todo_step(_FALLBACK_TODO))
+        finally:
+            pending.put(None)
+            consumer.join()
+        
+        remaining = self.todo_list[len(results):]
+        refusal = self._confirm_items(remaining)
+        if refusal:
+            return {
+                "status": "cancelled",
+                "message": refusal,
+                "results": results,
+                "todo_list": [item.to_dict() for item in self.todo_list]
+            }
+        
+        if remaining:
+            print("\n🚀 Executing remaining to-do items...")
+        for item in remaining:
+            results.append(self._execute_item(item, self._todo_step(item)))
+        
+        return self._finish_task(goal, results)
+    
+    @staticmethod
+    def _format_item(item: TodoItem) -> str:
+        """Format one to-do list entry, including its trailing blank line"""
+        risk_icon = _RISK_ICONS.get(item.risk_level, "❓")
+        return f"  {item.id}. {risk_icon} {item.command}\n     Reasoning: {item.reasoning}\n\n"
+    
+    def _confirm_items(self, items: List[TodoItem]) -> Optional[str]:
+        """Ask the user before running dangerous items
+        
+        Returns None to go ahead, or the reason execution was cancelled.
+        """
+        # The safety checker backs up the planner's own risk labels
+        checked_risks = AISafetyChecker.assess_risk_batch([item.command for item in items])
+        dangerous_items = [
+            item for item, risk in zip(items, checked_risks)
+            if item.risk_level in _CONFIRM_RISK_LEVELS or risk is CommandRisk.CRITICAL
+        ]
+        if not dangerous_items or self.auto_yes:
+            return None
+        
+        print("⚠️  WARNING: This plan contains potentially dangerous commands!")
+        # Nobody can answer the prompt, so don't wait for one
+        if not sys.stdin.isatty():
+            print("Not running interactively; use --yes to run it anyway")
+            return "Dangerous plan not confirmed: stdin is not interactive"
+        response = input("\nDo you want to continue? (y/N): ")
+        if response.lower() != 'y':
+            return "User cancelled execution"
+        return None
+    
+    def _execute_item(self, item: TodoItem, step: CommandStep) -> Dict[str, Any]:
+        """Execute one to-do item and record its outcome"""
+        result = self.planner.executor.execute_step(item.id - 1, step, self.session_id)
+        status = "completed" if result.get("success") else "failed"
+        self.update_todo_list(item.id, status, result.get("output", ""))
+        return result
+    
+    def _finish_task(self, goal: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Show the execution results and build run_task's return value"""
+        lines = []
+        
+        # Shows whether provider-side prompt caching is hitting
+        prompt_tokens = self.plan.prompt_tokens if self.plan is not None else 0
+        cached_tokens = self.plan.cached_tokens if self.plan is not None else 0
+        if prompt_tokens:
+            lines.append(f"\n🧊 Cached prompt tokens: {cached_tokens}/{prompt_tokens} "
+                         f"({cached_tokens * 100 // prompt_tokens}%)")
+        
+        # Display results, counting completed items in the same pass
+        lines.append("\n📊 Execution Results:")
+        success_count = 0
         for item in self.todo_list:
-            icon = "✅" if item.status == "completed" else "❌" if item.status == "failed" else "⏳"
-            print(f"  {icon} {item.command}")
+            if item.status == "completed":
+                success_count += 1
+            icon = _STATUS_ICONS.get(item.status, "⏳")
+            lines.append(f"  {icon} {item.command}")
             if item.output:
-                print(f"     Output: {item.output}")
+                lines.append(f"     Output: {item.output}")
         
-        success_count = sum(1 for item in self.todo_list if item.status == "completed")
         total_count = len(self.todo_list)
-        print(f"\n✅ Completed {success_count}/{total_count} tasks")
+        lines.append(f"\n✅ Completed {success_count}/{total_count} tasks\n")
+        sys.stdout.write("\n".join(lines))
+        
+        if self.plan is not None and success_count == total_count:
+            self.planner.remember_plan(goal, self.plan)
         
         return {
             "status": "completed" if success_count == total_count else "partial",
             "results": results,
-            "todo_list": [asdict(item) for item in self.todo_list]
+            "todo_list": [item.to_dict() for item in self.todo_list],
+            "usage": {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens}
         }
 
 # ======================
@@ -989,14 +2394,19 @@ class TerminalAIAgent:
 
 def main():
     """Main entry point for the Terminal AI Agent"""
-    # Load environment variables
-    load_dotenv()
-    
     parser = argparse.ArgumentParser(description="Terminal AI Agent")
-    parser.add_argument("--api-key", help="OpenAI API key", default=os.getenv("OPENAI_API_KEY"))
-    parser.add_argument("--base-url", help="OpenAI API base URL", default=os.getenv("OPENAI_BASE_URL"))
-    parser.add_argument("--model", help="AI model to use", default=os.getenv("AI_MODEL"))
+    parser.add_argument("--api-key", help="OpenAI API key", default=_DEFAULT_API_KEY)
+    parser.add_argument("--base-url", help="OpenAI API base URL", default=_DEFAULT_BASE_URL)
+    parser.add_argument("--model", help="AI model to use", default=_DEFAULT_MODEL)
     parser.add_argument("--goal", help="Goal to execute", required=True)
+    parser.add_argument("--plan-memory", help="SQLite file for reusing successful plans across runs",
+                        default=os.getenv("PLAN_MEMORY_PATH"))
+    parser.add_argument("--plan-memory-ttl", type=float, help="Seconds a remembered plan stays reusable",
+                        default=os.getenv("PLAN_MEMORY_TTL"))
+    parser.add_argument("--stream", action="store_true",
+                        help="Start running safe steps while the plan is still being generated")
+    parser.add_argument("--yes", action="store_true",
+                        help="Run dangerous commands without asking for confirmation")
     
     args = parser.parse_args()
     
@@ -1004,16 +2414,28 @@ def main():
         print("Error: OpenAI API key required. Set OPENAI_API_KEY environment variable or use --api-key")
         sys.exit(1)
     
+    plan_memory = None
+    if args.plan_memory:
+        # Plan memory is optional, so an unusable file only disables it
+        try:
+            plan_memory = PlanMemory(args.plan_memory, max_age=args.plan_memory_ttl)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Plan memory disabled, cannot open {args.plan_memory}: {e}")
+    
     # Create and run agent
-    agent = TerminalAIAgent(args.api_key, args.base_url, args.model)
+    agent = TerminalAIAgent(args.api_key, args.base_url, args.model, plan_memory, auto_yes=args.yes)
     
     try:
-        result = agent.run_task(args.goal)
-        print(json.dumps(result, indent=2, default=str))
+        if args.stream:
+            result = agent.run_streaming(args.goal)
+        else:
+            result = agent.run_task(args.goal)
+        _write_json(result)
     except KeyboardInterrupt:
         print("\nExecution cancelled by user")
     finally:
         manager.close_session(agent.session_id)
+        agent.planner.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file